@@ -1,9 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import json
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.lib import colors
+import os
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import uuid
@@ -17,6 +18,43 @@ def generate_voucher_code():
 st.set_page_config(page_title="Skinne Advisor", layout="wide", initial_sidebar_state="collapsed")
 
 # --- LOAD DATA FILES ---
+# Treatment sheets, selected by injectable preference
+SHEET_NAMES = ("Non-injectable", "All treatments")
+
+# Treatment sheet columns used for filtering, scoring and display
+TREATMENT_COLUMNS = [
+    'Treatment Brand/Name',
+    'Concern Code',
+    'Budget Level:\n(Price Per Session)\n\n1: SGD 20 - 99\n2: SGD 100 - 199\n3: SGD 200 - 299\n4: SGD 300 - 399\n5: SGD 400 - 499\n6: SGD 500 - 699\n7: SGD 700 - 999\n8: SGD 1000 - 1499\n9: SGD 1500 - 3000\n10: Above SGD 3000',
+    'Duration of Results:\n\n1: 12 months\n2: 6 months\n',
+    'Number of Sessions Required:\n\n1: 1 session\n2: 2 sessions\n3: 4 sessions\n4: 6 sessions',
+    'Discomfort Level',
+    'Delivery Mode',
+    'Amount of Downtime:\n\n1: None\n2: 1 day\n3: 3 days\n4: 7 days ',
+    'Prescribed Intervals between Sessions:\n\n1: 1 day\n2: 1 week\n3: 2 weeks\n4: 1 month\n5: 3 months\n6: 6 months',
+    'T-Score',
+]
+
+# Readable names for the treatment sheet columns
+COLUMN_RENAME_MAP = {
+    'Treatment Brand/Name': 'Treatment Name',
+    'Budget Level:\n(Price Per Session)\n\n1: SGD 20 - 99\n2: SGD 100 - 199\n3: SGD 200 - 299\n4: SGD 300 - 399\n5: SGD 400 - 499\n6: SGD 500 - 699\n7: SGD 700 - 999\n8: SGD 1000 - 1499\n9: SGD 1500 - 3000\n10: Above SGD 3000': 'Budget Level (SGD)',
+    'Duration of Results:\n\n1: 12 months\n2: 6 months\n': 'Duration of Results (months)',
+    'Number of Sessions Required:\n\n1: 1 session\n2: 2 sessions\n3: 4 sessions\n4: 6 sessions': 'Sessions Required',
+    'Level of Discomfort:\n\n1: Low\n2: Low-moderate\n3: Moderate\n4: Moderate-high\n5: High': 'Discomfort Level',
+    'Discomfort Level': 'Discomfort Level',
+    'Amount of Downtime:\n\n1: None\n2: 1 day\n3: 3 days\n4: 7 days ': 'Downtime',
+    'Prescribed Intervals between Sessions:\n\n1: 1 day\n2: 1 week\n3: 2 weeks\n4: 1 month\n5: 3 months\n6: 6 months': 'Interval Between Sessions',
+    'Delivery Mode': 'Delivery Mode',
+}
+
+# Columns shown in the recommendations table and PDF
+COLUMNS_TO_DISPLAY = [
+    'Treatment Name', 'Budget Level (SGD)', 'Duration of Results (months)',
+    'Sessions Required', 'Discomfort Level', 'Delivery Mode', 'Downtime',
+    'Interval Between Sessions'
+]
+
 @st.cache_data
 def load_questions():
     """Load survey questions from a JSON file."""
@@ -29,49 +67,99 @@ def load_concerns():
     with open("concerns.json", "r") as file:
         return json.load(file)
 
-@st.cache_data
-@st.cache_data
+@st.cache_resource
 def load_data(sheet_name):
-    """Load treatment attribute data from a specified Excel sheet."""
-    filepath = "Treatment Attribute Master (Skinne Advisor & Trainer).xlsx"
-    try:
-        return pd.read_excel(filepath, sheet_name=sheet_name)
-    except Exception as e:
-        st.error(f"Error loading data from sheet '{sheet_name}': {e}")
-        return pd.DataFrame()
+    """
+    Load treatment attribute data for a sheet from its Parquet export (see build_parquet.py).
+    
+    Errors are raised rather than reported here, since this runs in a background thread
+    where st.error is not shown; failed loads are not cached and are retried on the next call.
+    """
+    filepath = os.path.join("data", f"{sheet_name}.parquet")
+    return pd.read_parquet(filepath, engine="pyarrow", columns=TREATMENT_COLUMNS)
+
+@st.cache_resource
+def load_prepared(sheet_name):
+    """
+    Load treatment data as an Arrow table, with its T-Scores parsed into an integer
+    score matrix and its rows indexed by concern code prefix.
+    
+    The returned objects are shared across sessions and must not be modified.
+    """
+    data = load_data(sheet_name)
+    if data.empty:
+        return pa.table({}), np.empty((0, 0), dtype=np.int8), {}
+
+    data = data.dropna(subset=["Concern Code"]).reset_index(drop=True)
+    # Arrow-backed strings run the prefix matching below as Arrow compute kernels
+    data["Concern Code"] = data["Concern Code"].str.strip().astype("string[pyarrow]")
+    _, t_matrix = convert_t_scores(data["T-Score"])
+    t_matrix.flags.writeable = False
+
+    # Concern codes offered in the survey, e.g. "SK2" from "SK2 - Acne, Pores & Oily Skin"
+    prefixes = {option.split(" ")[0] for options in load_concerns().values() for option in options}
+    prefix_index = {
+        prefix: np.flatnonzero(data["Concern Code"].str.startswith(prefix).to_numpy(dtype=bool))
+        for prefix in prefixes
+    }
+    table = pa.Table.from_pandas(data.drop(columns=["T-Score"]), preserve_index=False)
+    return table, t_matrix, prefix_index
+
+def preload_prepared():
+    """Start preparing any treatment sheet this session has no load for, and return the futures by sheet name."""
+    futures = st.session_state.setdefault("prepared_futures", {})
+    missing_sheets = [sheet_name for sheet_name in SHEET_NAMES if sheet_name not in futures]
+    if missing_sheets:
+        executor = ThreadPoolExecutor(max_workers=len(missing_sheets))
+        for sheet_name in missing_sheets:
+            futures[sheet_name] = executor.submit(load_prepared, sheet_name)
+        # Submitted loads still run; the worker threads exit once they finish
+        executor.shutdown(wait=False)
+    return futures
+
+@st.cache_data
+def load_numbered_options():
+    """Number the options of every question and specific concern, e.g. '1) Clear Complexion'."""
+    numbered_questions = [
+        [f"{i + 1}) {option}" for i, option in enumerate(question["options"])]
+        for question in load_questions()
+    ]
+    numbered_concerns = {
+        concern: [f"{i + 1}) {option}" for i, option in enumerate(options)]
+        for concern, options in load_concerns().items()
+    }
+    return numbered_questions, numbered_concerns
 
 
 questions = load_questions()
-concerns = load_concerns()
+numbered_options_by_qid, numbered_concerns = load_numbered_options()
 
 # --- HELPER FUNCTIONS ---
-def render_question(question_data):
-    """Render a single question with numbered options and return the selected option."""
-    numbered_options = [f"{i + 1}) {option}" for i, option in enumerate(question_data["options"])]
+def render_question(question_index):
+    """Render the question at the given index with numbered options and return the selected option."""
     response = st.selectbox(
-        question_data["question"],
-        ["Select one option"] + numbered_options,
+        questions[question_index]["question"],
+        ["Select one option"] + numbered_options_by_qid[question_index],
         index=0,
     )
     if response != "Select one option":
         return int(response.split(")")[0])
     return None
 
-def render_survey(questions):
+def render_survey():
     """Render all survey questions and collect responses."""
     if "responses" not in st.session_state:
         st.session_state.responses = {}
     responses = st.session_state.responses
 
     # Render the primary concern question
-    primary_concern_index = render_question(questions[0])
+    primary_concern_index = render_question(0)
     if primary_concern_index:
         primary_concern = questions[0]["options"][primary_concern_index - 1]
         responses["Primary Concern"] = primary_concern
 
         # Render specific interest question based on primary concern
-        specific_options = concerns.get(primary_concern, [])
-        numbered_specific_options = [f"{i + 1}) {option}" for i, option in enumerate(specific_options)]
+        numbered_specific_options = numbered_concerns.get(primary_concern, [])
         specific_choice = st.selectbox(
             "Please select your specific interest:",
             ["Select one option"] + numbered_specific_options,
@@ -82,7 +170,7 @@ def render_survey(questions):
 
     # Render general survey questions
     for i, question in enumerate(questions[1:], start=1):
-        response = render_question(question)
+        response = render_question(i)
         if response:
             responses[question["question"]] = response
 
@@ -130,8 +218,11 @@ def display_p_score():
         print(len(questions))
         return
 
+    # Convert the P-Score values to an int8 vector once, for broadcasting against every treatment
+    p_vec = to_int_array(scores[1:])
+
     # Call the treatment recommendation function
-    recommend_treatments(scores)
+    recommend_treatments(specific_interest_code, p_vec)
 
     # Generate a unique voucher code
     voucher_code = generate_voucher_code()
@@ -141,90 +232,73 @@ def display_p_score():
     st.success(f"Thank you for completing the survey! Your unique voucher code is: **{voucher_code}**")
 
 
-def convert_t_score(t_score_str):
+def downcast_scores(values):
     """
-    Convert T-Score from string to a list of values.
+    Downcast parsed score values to an int8 NumPy array.
     
     Args:
-        t_score_str (str): A string representing a T-Score, formatted as '[id, value1, value2, ...]'.
+        values (pd.Series or pd.DataFrame): Numeric scores, with NaN for values that failed to parse.
     
     Returns:
-        list: A list where the first element is the ID (str) and subsequent elements are integers.
+        np.ndarray: The scores as int8, with -1 in place of missing, non-integer or out-of-range values,
+                    so a bad cell in the hand-edited sheet cannot silently wrap around.
     """
-    if not t_score_str or not isinstance(t_score_str, str):
-        raise ValueError("Input must be a non-empty string representing a T-Score.")
-
-    elements = t_score_str.strip("[]").replace("'", "").split(", ")
-    if len(elements) < 1:
-        raise ValueError("Input string is not in the expected format. Must contain at least one element.")
+    int8_info = np.iinfo(np.int8)
+    valid = values.ge(int8_info.min) & values.le(int8_info.max) & values.mod(1).eq(0)
+    return values.where(valid, -1).astype(np.int8).to_numpy()
 
-    def safe_int_conversion(value):
-        try:
-            return int(value.strip())
-        except ValueError:
-            return -1
+def to_int_array(values):
+    """Convert small score values to an int8 NumPy array, using -1 for anything that is not a valid integer."""
+    return downcast_scores(pd.to_numeric(pd.Series(values), errors="coerce"))
 
-    return [elements[0]] + [safe_int_conversion(i) for i in elements[1:]]
-
-def filter_treatments(data, concern_code):
+def convert_t_scores(t_scores):
     """
-    Filter treatments based on Concern Code.
+    Convert a column of T-Score strings into concern codes and an integer score matrix.
     
     Args:
-        data (pd.DataFrame): A Pandas DataFrame containing treatment data.
-        concern_code (str): The Concern Code to filter treatments by.
+        t_scores (pd.Series): T-Score strings, each formatted as '[id, value1, value2, ...]'.
     
     Returns:
-        pd.DataFrame: A filtered DataFrame containing treatments matching the Concern Code.
+        tuple: A Series of concern code strings and a 2D int8 NumPy array of scores,
+               with -1 in place of any value that is not a valid int8 integer.
     """
-    if not isinstance(data, pd.DataFrame) or data.empty:
-        raise ValueError("Input data must be a non-empty Pandas DataFrame.")
-
-    if "Concern Code" not in data.columns:
-        raise ValueError("Data does not contain the required 'Concern Code' column.")
-
-    if not isinstance(concern_code, str) or not concern_code.strip():
-        raise ValueError("Concern Code must be a non-empty string.")
+    if not isinstance(t_scores, pd.Series):
+        raise ValueError("Input must be a Pandas Series of T-Score strings.")
 
-    data = data.dropna(subset=["Concern Code"])
-    filtered_data = data[data["Concern Code"].str.startswith(concern_code)]
+    elements = t_scores.str.strip("[]").str.replace("'", "", regex=False).str.split(", ", expand=True)
+    if elements.shape[1] < 2:
+        raise ValueError("T-Scores are not in the expected format. Must contain at least one score element.")
 
-    if filtered_data.empty:
-        raise ValueError(f"No treatments found for Concern Code: {concern_code}")
-
-    return filtered_data
+    codes = elements.iloc[:, 0].str.strip()
+    values = elements.iloc[:, 1:].apply(lambda column: pd.to_numeric(column.str.strip(), errors="coerce"))
+    return codes, downcast_scores(values)
 
-def calculate_d_score(p_score, t_score):
+def filter_treatments(prefix_index, concern_code):
     """
-    Calculate D-Score based on P-Score and T-Score.
+    Find treatments based on Concern Code.
     
     Args:
-        p_score (list): A list where the first element is an identifier (e.g., concern code),
-                        and the subsequent elements are numerical scores.
-        t_score (list): A list in the same format as p_score.
+        prefix_index (dict): Concern code prefixes mapped to row positions, as built by load_prepared.
+        concern_code (str): The Concern Code to filter treatments by.
     
     Returns:
-        int: The calculated D-Score, representing the sum of absolute differences between scores.
+        np.ndarray: Row positions of the treatments matching the Concern Code.
     """
-    if not isinstance(p_score, list) or not isinstance(t_score, list):
-        raise ValueError("Both p_score and t_score must be lists.")
+    if not isinstance(prefix_index, dict) or not prefix_index:
+        raise ValueError("Prefix index must be a non-empty dictionary.")
 
-    if len(p_score) != len(t_score):
-        raise ValueError("p_score and t_score must have the same length.")
+    if not isinstance(concern_code, str) or not concern_code.strip():
+        raise ValueError("Concern Code must be a non-empty string.")
 
-    if len(p_score) <= 1 or len(t_score) <= 1:
-        raise ValueError("p_score and t_score must contain at least one scoring element beyond the first identifier.")
+    row_idx = prefix_index.get(concern_code, np.empty(0, dtype=np.int64))
 
-    def safe_int_conversion(value):
-        try:
-            return int(value)
-        except ValueError:
-            return -1
+    if row_idx.size == 0:
+        raise ValueError(f"No treatments found for Concern Code: {concern_code}")
 
-    return sum(abs(p - safe_int_conversion(t)) for p, t in zip(p_score[1:], t_score[1:]))
+    return row_idx
 
-def recommend_treatments(p_score):
-    """Generate treatment recommendations based on injectable preference."""
+def recommend_treatments(concern_code, p_vec):
+    """Generate treatment recommendations for a concern code and int8 P-Score vector, based on injectable preference."""
     # Retrieve the injectable preference from responses
     responses = st.session_state.get("responses", {})
     injectable_preference = responses.get("Delivery Mode")
@@ -236,53 +310,50 @@ def recommend_treatments(p_score):
         st.error("Invalid selection for injectable preference.")
         return
 
-    # Load data from the appropriate sheet
-    data = load_data(sheet_name)
-    if data.empty:
+    # Load data from the appropriate sheet, waiting for the background preload if it is still running
+    futures = preload_prepared()
+    try:
+        table, t_matrix, prefix_index = futures[sheet_name].result()
+    except Exception as e:
+        # Forget the failed load so the next submit retries it
+        futures.pop(sheet_name, None)
+        st.error(f"Error loading data from sheet '{sheet_name}': {e}")
+        return
+
+    if table.num_rows == 0:
         st.error(f"Unable to load data from the '{sheet_name}' sheet.")
         return
 
-    concern_code = p_score[0]
     if not concern_code:
         st.error("Invalid concern code extracted. Please check your responses.")
         return
 
-    # Continue with filtering, scoring, and displaying recommendations
-    data["T-Score"] = data["T-Score"].apply(convert_t_score)
-    data["D-Score"] = data.apply(lambda row: calculate_d_score(p_score, row["T-Score"]), axis=1)
-
-    filtered_data = filter_treatments(data, concern_code)
-    if filtered_data.empty:
+    # Filter first so only matching treatments are scored
+    try:
+        row_idx = filter_treatments(prefix_index, concern_code)
+    except ValueError:
         st.error(f"No treatments found for the Concern Code '{concern_code}'.")
         return
 
-    # Select the top 5 treatments with the smallest D-Score
-    top_recommendations = filtered_data.nsmallest(5, "D-Score")
+    # Widen before subtracting so int8 scores cannot overflow
+    d_scores = np.abs(t_matrix[row_idx].astype(np.int16) - p_vec.astype(np.int16)).sum(axis=1, dtype=np.int32)
+
+    # Select the top 5 treatments with the smallest D-Score; a partition finds the cut-off
+    # in linear time, and a stable sort of the survivors keeps ties in sheet order
+    k = min(5, d_scores.size)
+    cutoff = np.partition(d_scores, k - 1)[k - 1]
+    candidates = np.flatnonzero(d_scores <= cutoff)
+    top_positions = candidates[np.argsort(d_scores[candidates], kind="stable")[:k]]
+    # Only the selected rows are converted to pandas for display
+    top_recommendations = table.take(row_idx[top_positions]).to_pandas()
 
     # Rename columns for better readability
-    top_recommendations = top_recommendations.rename(columns={
-        'Treatment Brand/Name': 'Treatment Name',
-        'Budget Level:\n(Price Per Session)\n\n1: SGD 20 - 99\n2: SGD 100 - 199\n3: SGD 200 - 299\n4: SGD 300 - 399\n5: SGD 400 - 499\n6: SGD 500 - 699\n7: SGD 700 - 999\n8: SGD 1000 - 1499\n9: SGD 1500 - 3000\n10: Above SGD 3000': 'Budget Level (SGD)',
-        'Duration of Results:\n\n1: 12 months\n2: 6 months\n': 'Duration of Results (months)',
-        'Number of Sessions Required:\n\n1: 1 session\n2: 2 sessions\n3: 4 sessions\n4: 6 sessions': 'Sessions Required',
-        'Level of Discomfort:\n\n1: Low\n2: Low-moderate\n3: Moderate\n4: Moderate-high\n5: High': 'Discomfort Level',
-        'Discomfort Level':'Discomfort Level',
-        'Amount of Downtime:\n\n1: None\n2: 1 day\n3: 3 days\n4: 7 days ': 'Downtime',
-        'Prescribed Intervals between Sessions:\n\n1: 1 day\n2: 1 week\n3: 2 weeks\n4: 1 month\n5: 3 months\n6: 6 months': 'Interval Between Sessions',
-        'Delivery Mode': 'Delivery Mode'
-    })
+    top_recommendations = top_recommendations.rename(columns=COLUMN_RENAME_MAP)
 
     top_recommendations.index = range(1, len(top_recommendations) + 1)
 
-    # Define the columns to display
-    columns_to_display = [
-        'Treatment Name', 'Budget Level (SGD)', 'Duration of Results (months)',
-        'Sessions Required', 'Discomfort Level', 'Delivery Mode', 'Downtime',
-        'Interval Between Sessions'
-    ]
-
     # Select the columns for display
-    final_table = top_recommendations[columns_to_display]
+    final_table = top_recommendations[COLUMNS_TO_DISPLAY]
 
     # Save final_table to session_state
     st.session_state["final_table"] = final_table
@@ -296,22 +367,29 @@ def recommend_treatments(p_score):
 
 
 
-from reportlab.lib.pagesizes import landscape
-
 # Define a custom longer paper size
 CUSTOM_LONG_PAGE = (1200, 600)  # Width x Height in points
 
-def generate_pdf_from_dataframe(df):
+# Voucher codes are unique per submit, so entries are only reused within a session; bound the cache
+@st.cache_data(show_spinner=False, max_entries=100, ttl="1h")
+def generate_pdf(columns, records, voucher_code):
+    """Build the recommendations PDF, cached on the hashable table contents and voucher code."""
+    # ReportLab is only needed once a PDF is requested, so keep it off the app's cold start
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+    from reportlab.lib.pagesizes import landscape
+    from reportlab.lib import colors
+
     buffer = BytesIO()
 
     # Use the custom page size
     pdf = SimpleDocTemplate(buffer, pagesize=landscape(CUSTOM_LONG_PAGE))
 
     # Add voucher code to the data
-    voucher_code = st.session_state.get("voucher_code", "N/A")
-    voucher_row = ["VOUCHER CODE", voucher_code] + [""] * (len(df.columns) - 2)
+    voucher_row = ["VOUCHER CODE", voucher_code] + [""] * (len(columns) - 2)
 
-    data = [df.columns.tolist()] + df.values.tolist() + [voucher_row]
+    data = [list(columns)]
+    data.extend(map(list, records))
+    data.append(voucher_row)
     table = Table(data)
 
     # Set table styles
@@ -324,8 +402,13 @@ def generate_pdf_from_dataframe(df):
     ]))
 
     pdf.build([table])
-    buffer.seek(0)
-    return buffer
+    return buffer.getvalue()
+
+def generate_pdf_from_dataframe(df):
+    """Generate the recommendations PDF bytes for a DataFrame and the session's voucher code."""
+    voucher_code = st.session_state.get("voucher_code", "N/A")
+    records = tuple(df.itertuples(index=False, name=None))
+    return generate_pdf(tuple(df.columns), records, voucher_code)
 
 
 
@@ -350,8 +433,11 @@ def main():
         unsafe_allow_html=True,
     )
 
+    # Prepare the treatment sheets in the background while the survey is being filled in
+    preload_prepared()
+
     # Render the survey
-    render_survey(questions)
+    render_survey()
 
     # Add a submit button
     if st.button("Submit"):
@@ -359,7 +445,7 @@ def main():
 
     if "final_table" in st.session_state and st.session_state["final_table"] is not None:
         # Generate PDF from the dataframe
-        pdf_buffer = generate_pdf_from_dataframe(st.session_state["final_table"])
+        pdf_bytes = generate_pdf_from_dataframe(st.session_state["final_table"])
 
         # Create two columns
         col1, col2 = st.columns([1, 2])  # Adjust column proportions if needed
@@ -369,7 +455,7 @@ def main():
             # Add the download button in the first column
             st.download_button(
                 label="Download Table as PDF",
-                data=pdf_buffer,
+                data=pdf_bytes,
                 file_name="ClearSK_Top_5_Treatments.pdf",
                 mime="application/pdf",
             )
@@ -0,0 +1,27 @@
+import os
+
+import pandas as pd
+
+EXCEL_PATH = "Treatment Attribute Master (Skinne Advisor & Trainer).xlsx"
+OUTPUT_DIR = "data"
+
+
+def build_parquet(filepath=EXCEL_PATH, output_dir=OUTPUT_DIR):
+    """Write every sheet of the treatment workbook to its own Parquet file."""
+    os.makedirs(output_dir, exist_ok=True)
+    excel_file = pd.ExcelFile(filepath, engine="openpyxl")
+    for sheet_name in excel_file.sheet_names:
+        data = pd.read_excel(excel_file, sheet_name=sheet_name)
+
+        # Some columns mix numbers and text, which Parquet cannot store as one type
+        mixed_columns = [column for column in data.columns if data[column].dtype == object]
+        data[mixed_columns] = data[mixed_columns].astype("string")
+
+        output_path = os.path.join(output_dir, f"{sheet_name}.parquet")
+        data.to_parquet(output_path, engine="pyarrow", index=False)
+        print(f"Wrote {output_path}")
+
+
+# Run after every change to the workbook
+if __name__ == "__main__":
+    build_parquet()